@@ -1,18 +1,40 @@
 import streamlit as st
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from datetime import datetime
+from datetime import date
+from collections import Counter
+from contextlib import closing
+from itertools import zip_longest
+import atexit
+import json
+import os
+import sqlite3
 import time
+from uuid import uuid4
+from threading import Lock
 from streamlit_option_menu import option_menu
-from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import altair as alt
 
 # --- CONFIGURATION ---
-TMDB_API_KEY = st.secrets["tmdb_api_key"]
+# Optional v4 read token; when set it replaces the api_key query parameter
+TMDB_READ_TOKEN = st.secrets.get("tmdb_read_token")
+TMDB_API_KEY = None if TMDB_READ_TOKEN else st.secrets["tmdb_api_key"]
 SHEET_ID = st.secrets["sheet_id"]
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+BOOT_RANGES = ("Users!B2:B", "Activity_Log!A2:H", "Hidden!A:B")
+HISTORY_FULL_REFRESH = 300
+HISTORY_TAIL_REFRESH = 60
+ROWS_REFRESH = 300
+LOG_JOURNAL_PATH = ".pending_log.jsonl"
+# Numbers come back as numbers; dates keep their display string for pd.to_datetime
+READ_OPTS = {"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "FORMATTED_STRING"}
+HISTORY_COLS = ["Date", "Title", "Movie_ID", "Genres", "User", "Rating", "Type", "Poster"]
 
 # --- STREAMING PROVIDER MAP (US) ---
 PROVIDERS = {
@@ -20,8 +42,109 @@ PROVIDERS = {
     "Amazon Prime": 9, "Apple TV+": 350, "Peacock": 384, "Paramount+": 531
 }
 
+# --- HTTP SESSION ---
+MAX_WORKERS = 8
+
+TMDB_API = "https://api.themoviedb.org/3"
+
+@st.cache_resource(show_spinner=False)
+def get_tmdb_session():
+    """One keep-alive session per process, with a connection for every pool worker plus the script thread"""
+    session = requests.Session()
+    if TMDB_READ_TOKEN: session.headers["Authorization"] = f"Bearer {TMDB_READ_TOKEN}"
+    else: session.params = {"api_key": TMDB_API_KEY}
+    session.headers.update({"Accept": "application/json"})
+    session.mount("https://", HTTPAdapter(
+        pool_connections=2, pool_maxsize=MAX_WORKERS + 1,
+        # Only failed connections retry here; status retries go through tmdb_get so each one takes a token
+        max_retries=Retry(total=3, read=0, backoff_factor=0.5, respect_retry_after_header=False, raise_on_status=False)
+    ))
+    return session
+
+# --- TMDB DISK CACHE ---
+# st.cache_data is per-process; this survives restarts and is shared across workers
+TMDB_CACHE_PATH = ".tmdb_cache.sqlite"
+TMDB_CACHE_TTL = 86400
+
+@st.cache_resource(show_spinner=False)
+def init_tmdb_cache():
+    """Creates the response table once per process"""
+    with closing(sqlite3.connect(TMDB_CACHE_PATH)) as conn, conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, body TEXT NOT NULL, expires REAL NOT NULL)")
+    return TMDB_CACHE_PATH
+
+# Client-side token bucket: TMDB allows 40 requests per 10 seconds
+TMDB_BURST = 40
+TMDB_RATE = 4.0
+TMDB_RETRY_STATUSES = (429, 500, 502, 503, 504)
+TMDB_ATTEMPTS = 4
+
+@st.cache_resource(show_spinner=False)
+def get_tmdb_bucket():
+    """Token bucket shared by every rerun and session in the process"""
+    return {'tokens': TMDB_BURST, 'stamp': time.monotonic(), 'lock': Lock()}
+
+def take_tmdb_token():
+    """Blocks until the bucket allows another TMDB request"""
+    bucket = get_tmdb_bucket()
+    with bucket['lock']:
+        while True:
+            now = time.monotonic()
+            bucket['tokens'] = min(TMDB_BURST, bucket['tokens'] + (now - bucket['stamp']) * TMDB_RATE)
+            bucket['stamp'] = now
+            if bucket['tokens'] >= 1: break
+            time.sleep((1 - bucket['tokens']) / TMDB_RATE)
+        bucket['tokens'] -= 1
+
+def tmdb_get(path, params=None, ttl=TMDB_CACHE_TTL):
+    """GET a TMDB endpoint as JSON, served from the disk cache for ttl seconds"""
+    # The encoded URL (minus the session's api_key) doubles as the cache key
+    req = requests.PreparedRequest()
+    req.prepare_url(TMDB_API + path, params)
+    url = req.url
+    with closing(sqlite3.connect(init_tmdb_cache(), timeout=5)) as conn:
+        hit = conn.execute("SELECT body FROM responses WHERE url = ? AND expires > ?", (url, time.time())).fetchone()
+        if hit: return json.loads(hit[0])
+        for attempt in range(TMDB_ATTEMPTS):
+            take_tmdb_token()
+            resp = get_tmdb_session().get(url, timeout=5)
+            if resp.status_code not in TMDB_RETRY_STATUSES or attempt == TMDB_ATTEMPTS - 1: break
+            wait = resp.headers.get("Retry-After", "")
+            time.sleep(int(wait) if wait.isdigit() else 0.5 * 2 ** attempt)
+        if resp.ok:
+            now = time.time()
+            with conn:
+                conn.execute("DELETE FROM responses WHERE expires < ?", (now,))
+                conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (url, resp.content, now + ttl))
+        return json.loads(resp.content)
+
+def drop_tmdb_cache(path):
+    """Evicts disk-cached responses under an endpoint path"""
+    with closing(sqlite3.connect(init_tmdb_cache(), timeout=5)) as conn, conn:
+        conn.execute("DELETE FROM responses WHERE url LIKE ?", (TMDB_API + path + "%",))
+
+@st.cache_resource(show_spinner=False)
+def get_pool():
+    """Shared worker pool for fanning out independent TMDB calls"""
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+@st.cache_resource(show_spinner=False)
+def get_log_writer():
+    """The process's single Activity_Log writer; one thread keeps appends in order"""
+    writer = ThreadPoolExecutor(max_workers=1)
+    atexit.register(writer.shutdown)
+    # Entries an earlier process left in the journal go out before any new log
+    writer.submit(flush_log_journal, None, None)
+    return writer
+
+@st.cache_resource(show_spinner=False)
+def get_journal_lock():
+    """Guards the log journal, which every session appends to and the writer trims"""
+    return Lock()
+
 # --- CSS STYLING ---
-st.markdown("""
+CSS_BLOCK = """
+<link rel="preconnect" href="https://image.tmdb.org">
 <style>
     h1, h2, h3, p, div { font-family: 'Helvetica Neue', sans-serif; }
     
@@ -86,41 +209,73 @@ st.markdown("""
         font-size: 0.8rem; margin-right: 5px; display: inline-block;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+LOGO_HTML = """
+<div style="display: flex; align-items: center; margin-bottom: 20px;">
+    <span style="font-size: 2.5rem;">🎬</span>
+    <span style="font-size: 2rem; font-weight: 800; color: #E50914; letter-spacing: -1px; margin-left: 10px;">Cine</span>
+    <span style="font-size: 2rem; font-weight: 800; color: #ffffff; letter-spacing: -1px;">Match</span>
+</div>
+"""
+
+st.markdown(CSS_BLOCK, unsafe_allow_html=True)
 
 # --- BACKEND FUNCTIONS ---
 
-def get_google_sheet_client():
-    creds = service_account.Credentials.from_service_account_info(
+@st.cache_resource(show_spinner=False)
+def get_google_credentials():
+    return service_account.Credentials.from_service_account_info(
         st.secrets["gcp_service_account"], scopes=SCOPES
     )
-    return build("sheets", "v4", credentials=creds).spreadsheets()
+
+@st.cache_resource(show_spinner=False)
+def get_google_sheet_client():
+    creds = get_google_credentials()
+    # Bundled discovery doc, so build() makes no HTTP request
+    return build("sheets", "v4", credentials=creds, cache_discovery=False, static_discovery=True).spreadsheets()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_range(range_name):
+    service = get_google_sheet_client()
+    result = service.values().get(spreadsheetId=SHEET_ID, range=range_name, majorDimension="ROWS", **READ_OPTS).execute()
+    return result.get('values', [])
 
 def get_data(range_name):
-    try:
-        service = get_google_sheet_client()
-        result = service.values().get(spreadsheetId=SHEET_ID, range=range_name).execute()
-        return result.get('values', [])
+    # Failures stay outside the cache so the next rerun retries
+    try: return get_range(range_name)
     except: return []
 
+@st.cache_data(ttl=60, show_spinner=False)
+def get_data_multi(ranges):
+    service = get_google_sheet_client()
+    result = service.values().batchGet(spreadsheetId=SHEET_ID, ranges=list(ranges), majorDimension="ROWS", **READ_OPTS).execute()
+    return [vr.get('values', []) for vr in result.get('valueRanges', [])]
+
+def get_boot_data():
+    """Users, Activity_Log and Hidden in a single batchGet round-trip"""
+    try: return get_data_multi(BOOT_RANGES)
+    except: return [[] for _ in BOOT_RANGES]
+
 def get_users():
-    rows = get_data("Users!A:B")
-    if not rows or len(rows) < 2: return []
-    return [row[1] for row in rows[1:]]
+    return [r[0] for r in get_boot_data()[0] if r]
 
 def add_user(name, favorite_genres, seed_movies):
     service = get_google_sheet_client()
-    rows = get_data("Users!A:A")
-    new_id = len(rows) if rows else 1
+    # Uncached read, so concurrent adds see each other's rows
+    ids = service.values().get(spreadsheetId=SHEET_ID, range="Users!A:A", majorDimension="COLUMNS").execute().get('values', [[]])[0]
+    new_id = len(ids) or 1
     row = [[new_id, name, ", ".join(favorite_genres), str(seed_movies)]]
     service.values().append(
         spreadsheetId=SHEET_ID, range="Users!A:D",
-        valueInputOption="USER_ENTERED", body={'values': row}
+        valueInputOption="RAW", body={'values': row}
     ).execute()
+    get_data_multi.clear()
+    get_range.clear()
+    st.session_state.users = []
 
 def log_media(title, movie_id, genres, users_ratings, media_type, poster_path):
-    service = get_google_sheet_client()
-    timestamp = datetime.now().strftime("%Y-%m-%d")
+    timestamp = date.today().isoformat()
     
     genre_str = "Unknown"
     try:
@@ -128,142 +283,303 @@ def log_media(title, movie_id, genres, users_ratings, media_type, poster_path):
             if isinstance(genres[0], dict):
                 genre_str = ", ".join([g.get('name', '') for g in genres])
             elif isinstance(genres[0], int):
-                genre_str = str(genres) 
+                id_map = get_genre_map_reversed(media_type)
+                genre_str = ", ".join([id_map.get(str(g), str(g)) for g in genres])
         else: genre_str = str(genres)
     except: genre_str = "Error"
 
-    new_rows = []
-    for user, rating in users_ratings.items():
-        new_rows.append([timestamp, title, str(movie_id), genre_str, user, str(rating), media_type, poster_path])
-    
-    service.values().append(
-        spreadsheetId=SHEET_ID, range="Activity_Log!A:H",
-        valueInputOption="USER_ENTERED", body={'values': new_rows}
-    ).execute()
+    rows = [[timestamp, title, int(movie_id), genre_str, user, int(rating), media_type, poster_path] for user, rating in users_ratings.items()]
+    submit_log_rows(rows)
     st.toast(f"Logged {title}!")
 
+def read_log_journal():
+    try:
+        with open(LOG_JOURNAL_PATH) as f: return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError: return []
+
+def submit_log_rows(rows):
+    """Journals a log's rows, then hands them to the background writer without waiting on it"""
+    entry = {'id': uuid4().hex, 'rows': rows}
+    with get_journal_lock(), open(LOG_JOURNAL_PATH, "a") as f: f.write(json.dumps(entry) + "\n")
+    get_log_writer().submit(flush_log_journal, entry['id'], st.session_state.log_status)
+    # Shown locally until a sheet read returns them
+    st.session_state.local_log.extend(rows)
+    if 'sheet_history' in st.session_state: compose_history()
+
+def flush_log_journal(entry_id, status):
+    """Background half of submit_log_rows: every journaled entry goes out in one append, then leaves the journal"""
+    with get_journal_lock(): pending = read_log_journal()
+    # Logs queued behind a running append all go out in the next flush
+    if not pending: return
+    try:
+        get_google_sheet_client().values().append(
+            spreadsheetId=SHEET_ID, range="Activity_Log!A:H",
+            valueInputOption="RAW", body={'values': [r for e in pending for r in e['rows']]}
+        ).execute(num_retries=3)
+    except Exception:
+        # Entries stay journaled for the next flush; the session's next rerun reports the failure
+        if status is not None: status['failed'] += sum(len(e['rows']) for e in pending if e['id'] == entry_id)
+        return
+    sent = {e['id'] for e in pending}
+    with get_journal_lock():
+        keep = [e for e in read_log_journal() if e['id'] not in sent]
+        with open(LOG_JOURNAL_PATH + ".tmp", "w") as f: f.writelines(json.dumps(e) + "\n" for e in keep)
+        os.replace(LOG_JOURNAL_PATH + ".tmp", LOG_JOURNAL_PATH)
+    get_data_multi.clear()
+    get_range.clear()
+    get_watched_history.clear()
+
 def hide_media_db(user, movie_id):
     service = get_google_sheet_client()
-    timestamp = datetime.now().strftime("%Y-%m-%d")
-    row = [[user, str(movie_id), timestamp]]
+    timestamp = date.today().isoformat()
+    row = [[user, int(movie_id), timestamp]]
     try:
         service.values().append(
             spreadsheetId=SHEET_ID, range="Hidden!A:C",
-            valueInputOption="USER_ENTERED", body={'values': row}
+            valueInputOption="RAW", body={'values': row}
         ).execute()
+        get_data_multi.clear()
+        get_range.clear()
     except Exception as e: st.error(f"Could not save hide: {e}")
 
 def get_hidden_ids(user):
-    rows = get_data("Hidden!A:B")
+    rows = get_boot_data()[2]
     if not rows: return set()
-    return set([row[1] for row in rows if len(row) > 1 and row[0] == user])
-
+    return {int(row[1]) for row in rows if len(row) > 1 and row[0] == user and str(row[1]).isdigit()}
+
+def build_history(rows):
+    """Typed history frame from raw Activity_Log rows (no header)"""
+    # Sheets trims trailing empty cells, so short rows are padded
+    cols = [list(c) for c in zip_longest(*rows, fillvalue='')][:len(HISTORY_COLS)]
+    cols += [[''] * len(rows) for _ in range(len(HISTORY_COLS) - len(cols))]
+    dates, titles, movie_ids, genres, users, ratings, media_types, posters = cols
+    return pd.DataFrame({
+        'Date': pd.to_datetime(dates, errors='coerce'),
+        'Title': titles,
+        'Movie_ID': pd.array(pd.to_numeric(movie_ids, errors='coerce'), dtype='Int64'),
+        'Genres': genres,
+        'User': pd.Categorical(users),
+        'Rating': pd.to_numeric(ratings, errors='coerce').astype('float32'),
+        'Type': pd.Categorical(media_types),
+        'Poster': posters,
+    })
+
+@st.cache_data(ttl=60, show_spinner=False)
 def get_watched_history():
-    rows = get_data("Activity_Log!A:H")
-    if len(rows) < 2: return pd.DataFrame()
-    return pd.DataFrame(rows[1:], columns=["Date", "Title", "Movie_ID", "Genres", "User", "Rating", "Type", "Poster"])
+    rows = get_boot_data()[1]
+    if not rows: return pd.DataFrame()
+    return build_history(rows)
+
+def concat_history(a, b):
+    if a.empty: return b
+    df = pd.concat([a, b], ignore_index=True)
+    for col in ('User', 'Type'): df[col] = df[col].astype('category')
+    return df
+
+def set_history(df):
+    st.session_state.history_df = df
+    # Derived views key on this rather than on the row count
+    st.session_state.history_version = st.session_state.get('history_version', 0) + 1
+    st.session_state.history_by_user = {} if df.empty else df.groupby('User', observed=True, sort=False).indices
+
+def compose_history():
+    """Session history: rows read from the sheet, then this session's logs the sheet has not returned yet"""
+    ss = st.session_state
+    df = ss.sheet_history
+    if ss.local_log: df = concat_history(df, build_history(ss.local_log))
+    set_history(df)
+
+def settle_local_log(df):
+    """Drops this session's logged rows that a sheet read has now returned, one per matching row"""
+    if df.empty: return
+    landed = Counter(zip(df['Date'].dt.strftime('%Y-%m-%d'), df['Movie_ID'], df['User'].astype(str)))
+    kept = []
+    for r in st.session_state.local_log:
+        key = (r[0], int(r[2]), r[4])
+        if landed[key]: landed[key] -= 1
+        else: kept.append(r)
+    st.session_state.local_log = kept
+
+def load_history():
+    """Session copy of the history: a full read every few minutes, otherwise only rows past the last one seen"""
+    ss = st.session_state
+    now = time.monotonic()
+    if 'sheet_history' not in ss or now - ss.history_loaded_at > HISTORY_FULL_REFRESH:
+        ss.sheet_history = get_watched_history()
+        # Watermark: data rows read from the sheet, never counting rows this session added locally
+        ss.sheet_rows = len(ss.sheet_history)
+        settle_local_log(ss.sheet_history)
+        compose_history()
+        ss.history_loaded_at = ss.history_tail_at = now
+    elif now - ss.history_tail_at > HISTORY_TAIL_REFRESH:
+        # Row 1 is the header, so the first unseen row is sheet_rows + 2
+        tail = get_data(f"Activity_Log!A{ss.sheet_rows + 2}:H")
+        if tail:
+            tail_df = build_history(tail)
+            ss.sheet_history = concat_history(ss.sheet_history, tail_df)
+            ss.sheet_rows += len(tail)
+            settle_local_log(tail_df)
+            compose_history()
+        ss.history_tail_at = now
+    return ss.history_df
+
+def get_user_history(user):
+    history = st.session_state.history_df
+    if history.empty: return history
+    return history.iloc[st.session_state.history_by_user.get(user, [])]
+
+def parallel_map(fn, items):
+    """Runs fn over items on the shared pool, preserving order and the script context"""
+    ctx = get_script_run_ctx()
+    def run(item):
+        add_script_run_ctx(ctx=ctx)
+        return fn(item)
+    return list(get_pool().map(run, items))
+
+def prefetch(fn, *args):
+    """Warms a cached function in the background; later calls pick the result up from the cache"""
+    ctx = get_script_run_ctx()
+    def run():
+        add_script_run_ctx(ctx=ctx)
+        try: fn(*args)
+        except: pass
+    get_pool().submit(run)
+
+def split_genres(genres, g_map_rev):
+    """Explodes a Genres column to one genre name per row, mapping TMDB ids to names"""
+    parts = genres.astype(str).str.replace(r"[\[\]']", "", regex=True).str.split(',').explode().str.strip()
+    return parts.map(g_map_rev).fillna(parts)
 
 # --- TMDB FUNCTIONS ---
-@st.cache_data
+@st.cache_resource(ttl=86400, show_spinner=False)
 def get_tmdb_genres(media_type="movie"):
     endpoint = "tv" if media_type == "tv" else "movie"
-    url = f"https://api.themoviedb.org/3/genre/{endpoint}/list?api_key={TMDB_API_KEY}&language=en-US"
-    data = requests.get(url).json()
+    data = tmdb_get(f"/genre/{endpoint}/list", {"language": "en-US"}, ttl=86400)
     return {g['name']: g['id'] for g in data.get('genres', [])}
 
-@st.cache_data
+@st.cache_resource(ttl=86400, show_spinner=False)
 def get_genre_map_reversed(media_type="movie"):
-    try:
-        endpoint = "tv" if media_type == "tv" else "movie"
-        url = f"https://api.themoviedb.org/3/genre/{endpoint}/list?api_key={TMDB_API_KEY}&language=en-US"
-        data = requests.get(url).json()
-        return {str(g['id']): g['name'] for g in data.get('genres', [])}
+    try: return {str(g_id): name for name, g_id in get_tmdb_genres(media_type).items()}
     except: return {}
 
-@st.cache_data(ttl=3600)
+def extract_provider_logos(data):
+    """US flatrate provider logo URLs from a watch/providers payload"""
+    providers = []
+    seen = set()
+    if 'results' in data and 'US' in data['results']:
+        us = data['results']['US']
+        if 'flatrate' in us:
+            for p in us['flatrate']:
+                if p['provider_name'] not in seen and p.get('logo_path'):
+                    providers.append(f"https://image.tmdb.org/t/p/w45{p['logo_path']}")
+                    seen.add(p['provider_name'])
+    return tuple(providers)
+
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_watch_providers(media_id, media_type="movie"):
     try:
         endpoint = "tv" if media_type == "tv" else "movie"
-        url = f"https://api.themoviedb.org/3/{endpoint}/{media_id}/watch/providers?api_key={TMDB_API_KEY}"
-        data = requests.get(url).json()
-        providers = []
-        seen = set()
-        if 'results' in data and 'US' in data['results']:
-            us = data['results']['US']
-            if 'flatrate' in us:
-                for p in us['flatrate']:
-                    if p['provider_name'] not in seen and p.get('logo_path'):
-                        providers.append(f"https://image.tmdb.org/t/p/w45{p['logo_path']}")
-                        seen.add(p['provider_name'])
-        return providers
-    except: return []
+        return extract_provider_logos(tmdb_get(f"/{endpoint}/{media_id}/watch/providers", ttl=3600))
+    except: return ()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_media_details(media_id, media_type="movie"):
+    """Details plus videos, credits and providers bundled into a single request"""
+    endpoint = "tv" if media_type == "tv" else "movie"
+    return tmdb_get(f"/{endpoint}/{media_id}", {"append_to_response": "videos,credits,watch/providers"}, ttl=3600)
 
-@st.cache_data
 def get_credits_and_trailer(media_id, media_type="movie"):
     """Fetches trailer key and top credits"""
-    endpoint = "tv" if media_type == "tv" else "movie"
+    data = get_media_details(media_id, media_type)
     
     # Trailer
-    vid_url = f"https://api.themoviedb.org/3/{endpoint}/{media_id}/videos?api_key={TMDB_API_KEY}"
-    vid_data = requests.get(vid_url).json()
     trailer_key = None
-    for vid in vid_data.get('results', []):
+    for vid in data.get('videos', {}).get('results', []):
         if vid['site'] == 'YouTube' and vid['type'] == 'Trailer':
             trailer_key = vid['key']
             break
             
     # Credits
-    cred_url = f"https://api.themoviedb.org/3/{endpoint}/{media_id}/credits?api_key={TMDB_API_KEY}"
-    cred_data = requests.get(cred_url).json()
-    
+    cred_data = data.get('credits', {})
     director = [c['name'] for c in cred_data.get('crew', []) if c['job'] == 'Director']
     cast = [c['name'] for c in cred_data.get('cast', [])[:3]]
     
     return trailer_key, director[:1], cast
 
-def get_genre_rows_data(genre_id, media_type, provider_ids=None, page=1, avoid_ids=None):
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_discover_page(genre_id, media_type, provider_ids=None, page=1):
     endpoint = "tv" if media_type == "tv" else "movie"
-    base_url = f"https://api.themoviedb.org/3/discover/{endpoint}?api_key={TMDB_API_KEY}&language=en-US"
-    params = f"&with_genres={genre_id}&sort_by=popularity.desc&vote_count.gte=200&page={page}"
+    params = {"language": "en-US", "with_genres": genre_id, "sort_by": "popularity.desc", "vote_count.gte": 200, "page": page}
     if provider_ids:
-        p_str = "|".join([str(p) for p in provider_ids])
-        params += f"&with_watch_providers={p_str}&watch_region=US"
-        
-    data = requests.get(base_url + params).json().get('results', [])
+        params["with_watch_providers"] = "|".join([str(p) for p in provider_ids])
+        params["watch_region"] = "US"
+    return tmdb_get(f"/discover/{endpoint}", params, ttl=3600).get('results', [])
+
+def get_genre_rows_data(genre_id, media_type, provider_ids=None, page=1, avoid_ids=None):
+    # Sorted tuple: hashable for the cache key and independent of selection order
+    data = get_discover_page(genre_id, media_type, tuple(sorted(provider_ids)) if provider_ids else None, page)
     
-    filtered = []
     if avoid_ids:
-        for m in data:
-            if str(m['id']) not in avoid_ids:
-                filtered.append(m)
-        return filtered
+        return [m for m in data if m['id'] not in avoid_ids]
     return data
 
+def take_unseen(movies, seen, limit=5):
+    """First `limit` movies whose ids are not in seen, marking them seen"""
+    picked = []
+    for m in movies:
+        if m['id'] in seen: continue
+        seen.add(m['id'])
+        picked.append(m)
+        if len(picked) == limit: break
+    return picked
+
+@st.cache_data(ttl=600, show_spinner=False)
 def search_tmdb(query):
-    url = f"https://api.themoviedb.org/3/search/multi?api_key={TMDB_API_KEY}&query={query}"
-    return requests.get(url).json().get('results', [])
+    return tmdb_get("/search/multi", {"query": query}, ttl=600).get('results', [])
 
 # --- HTML GENERATOR ---
+# Score colors index as red < 40 <= yellow < 70 <= green
+SCORE_COLORS = ("#db2360", "#d2d531", "#21d07a")
+CARD_TPL = '<div class="movie-card"><img src="{poster}"{srcset} class="movie-img" loading="lazy" decoding="async">{tmdb}{user}{stream}</div>'
+# Cards render at roughly a sixth of the viewport, so w185 covers 1x screens and w342 covers 2x
+CARD_SRCSET_TPL = ' srcset="https://image.tmdb.org/t/p/w185{p} 185w, https://image.tmdb.org/t/p/w342{p} 342w" sizes="16vw"'
+TMDB_BADGE_TPL = '<div class="rating-badge badge-left" style="border-color: {color};"><span class="badge-label">TMDB</span>{score}</div>'
+USER_BADGE_TPL = '<div class="rating-badge badge-right"><span class="badge-label">YOU</span>{score}</div>'
+STREAM_LOGO_TPL = '<img src="{}" class="stream-logo">'
+
 def render_card(poster_path, tmdb_score, user_score=None, provider_logos=None):
-    poster_url = f"https://image.tmdb.org/t/p/w400{poster_path}" if poster_path else "https://via.placeholder.com/200x300"
+    poster_url = f"https://image.tmdb.org/t/p/w185{poster_path}" if poster_path else "https://via.placeholder.com/200x300"
+    srcset = CARD_SRCSET_TPL.format(p=poster_path) if poster_path else ""
     
     tmdb_html = ""
     if tmdb_score is not None and tmdb_score > 0:
-        color = "#21d07a" 
-        if tmdb_score < 70: color = "#d2d531" 
-        if tmdb_score < 40: color = "#db2360" 
-        tmdb_html = f'<div class="rating-badge badge-left" style="border-color: {color};"><span class="badge-label">TMDB</span>{tmdb_score}</div>'
+        score = min(int(tmdb_score), 100)
+        tmdb_html = TMDB_BADGE_TPL.format(color=SCORE_COLORS[(score >= 40) + (score >= 70)], score=score)
     
     user_html = ""
     if user_score is not None and str(user_score) != 'nan':
-        user_html = f'<div class="rating-badge badge-right"><span class="badge-label">YOU</span>{int(float(user_score))}</div>'
+        user_html = USER_BADGE_TPL.format(score=int(float(user_score)))
 
     stream_html = ""
     if provider_logos:
-        logos_str = "".join([f'<img src="{l}" class="stream-logo">' for l in provider_logos[:3]])
+        logos_str = "".join(map(STREAM_LOGO_TPL.format, provider_logos[:3]))
         stream_html = f'<div class="stream-container">{logos_str}</div>'
 
-    return f'<div class="movie-card"><img src="{poster_url}" class="movie-img">{tmdb_html}{user_html}{stream_html}</div>'
+    return CARD_TPL.format(poster=poster_url, srcset=srcset, tmdb=tmdb_html, user=user_html, stream=stream_html)
+
+# --- CARD ACTIONS ---
+def open_detail(item, media_type):
+    item['title'] = item.get('title', item.get('name'))
+    item['media_type'] = media_type
+    st.session_state.view_movie_detail = item
+
+def hide_card(user, movie_id):
+    st.session_state.hidden_movies.add(movie_id)
+    if 'avoid_ids' in st.session_state: st.session_state.avoid_ids.add(movie_id)
+    hide_media_db(user, movie_id)
+
+def next_page(page_key, pages_used):
+    st.session_state.genre_pages[page_key] += pages_used
 
 # --- APP STARTUP ---
 st.set_page_config(page_title="Cinematch", layout="wide", page_icon="🎬")
@@ -273,20 +589,31 @@ if 'hidden_movies' not in st.session_state: st.session_state.hidden_movies = set
 if 'view_movie_detail' not in st.session_state: st.session_state.view_movie_detail = None
 if 'genre_pages' not in st.session_state: st.session_state.genre_pages = {} 
 
-existing_users = get_users()
+if 'local_log' not in st.session_state: st.session_state.local_log = []
+if 'log_status' not in st.session_state: st.session_state.log_status = {'failed': 0}
+
+if not st.session_state.get('users'): st.session_state.users = get_users()
+load_history()
+
+# Starting the writer sends anything left in the journal, once per process
+get_log_writer()
+failed = st.session_state.log_status['failed']
+if failed:
+    st.warning(f"{failed} log {'entry' if failed == 1 else 'entries'} could not be saved to Google Sheets. They are kept on disk and will be retried with the next log.")
+    st.session_state.log_status['failed'] -= failed
+
+existing_users = st.session_state.users
+
+if 'genres_prefetched' not in st.session_state:
+    for mt in ("movie", "tv"): prefetch(get_tmdb_genres, mt)
+    st.session_state.genres_prefetched = True
 if not existing_users:
     st.warning("Please create a profile.")
     st.stop()
 
 # --- SIDEBAR ---
 with st.sidebar:
-    st.markdown("""
-    <div style="display: flex; align-items: center; margin-bottom: 20px;">
-        <span style="font-size: 2.5rem;">🎬</span>
-        <span style="font-size: 2rem; font-weight: 800; color: #E50914; letter-spacing: -1px; margin-left: 10px;">Cine</span>
-        <span style="font-size: 2rem; font-weight: 800; color: #ffffff; letter-spacing: -1px;">Match</span>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(LOGO_HTML, unsafe_allow_html=True)
     
     current_users = existing_users + ["➕ Add Profile"]
     active_user = st.selectbox("Watching Now:", current_users)
@@ -296,10 +623,7 @@ with st.sidebar:
 # --- HOME PAGE ---
 if nav_choice == "Home":
     
-    history = get_watched_history()
-    user_history = pd.DataFrame()
-    if not history.empty:
-        user_history = history[history['User'] == active_user]
+    user_history = get_user_history(active_user)
     
     if 'hidden_synced' not in st.session_state:
         db_hidden = get_hidden_ids(active_user)
@@ -324,9 +648,8 @@ if nav_choice == "Home":
 
     # 3. STATS DASHBOARD
     if not user_history.empty:
-        chart_data = user_history.copy()
-        chart_data['Rating'] = pd.to_numeric(chart_data['Rating'], errors='coerce')
-        chart_data = chart_data.dropna(subset=['Rating'])
+        # Only Rating feeds the chart; Altair inlines every column it is given
+        chart_data = user_history[['Rating']].dropna()
         
         avg_rating = chart_data['Rating'].mean()
         total_rated = len(chart_data)
@@ -353,13 +676,9 @@ if nav_choice == "Home":
                 st.markdown(f"<div class='stat-box'><div class='stat-value accent-blue'>{total_rated}</div><div class='stat-label'>Rated</div></div>", unsafe_allow_html=True)
             
             g_map_rev = get_genre_map_reversed(media_type)
-            all_g = []
-            for g_str in user_history['Genres']:
-                if g_str and g_str.lower() not in ['unknown', 'error']:
-                    clean = str(g_str).replace('[', '').replace(']', '').replace("'", "")
-                    parts = [x.strip() for x in clean.split(',')]
-                    for p in parts: all_g.append(g_map_rev.get(p, p))
-            top_genre = Counter(all_g).most_common(1)[0][0] if all_g else "-"
+            g_col = user_history['Genres'].fillna('')
+            g_col = g_col[~g_col.str.lower().isin(['', 'unknown', 'error'])]
+            top_genre = split_genres(g_col, g_map_rev).value_counts().idxmax() if not g_col.empty else "-"
             
             with c_s2:
                 st.markdown(f"<div class='stat-box'><div class='stat-value'>{top_genre}</div><div class='stat-label'>Top Genre</div></div>", unsafe_allow_html=True)
@@ -378,11 +697,14 @@ if nav_choice == "Home":
             st.session_state.view_movie_detail = None
             st.rerun()
         
+        # Search hits carry their own type, which may differ from the Movies/TV toggle
+        m_type = m.get('media_type', media_type)
+
         # Fetch Extended Info
-        trailer, directors, cast = get_credits_and_trailer(m['id'], media_type)
+        trailer, directors, cast = get_credits_and_trailer(m['id'], m_type)
         
         c1, c2 = st.columns([1,2])
-        with c1: st.image(f"https://image.tmdb.org/t/p/w400{m['poster_path']}", use_container_width=True)
+        with c1: st.image(f"https://image.tmdb.org/t/p/w342{m['poster_path']}", width=240)
         with c2:
             st.markdown(f"## {m.get('title', m.get('name'))}")
             
@@ -400,7 +722,8 @@ if nav_choice == "Home":
             else:
                 st.info("No trailer available.")
                 
-            if 'provider_logos' not in m: m['provider_logos'] = get_watch_providers(m['id'], media_type)
+            if 'provider_logos' not in m:
+                m['provider_logos'] = extract_provider_logos(get_media_details(m['id'], m_type).get('watch/providers', {}))
             if m['provider_logos']:
                 logos = "".join([f'<img src="{l}" class="detail-stream-logo">' for l in m['provider_logos']])
                 st.write("")
@@ -411,10 +734,10 @@ if nav_choice == "Home":
             user_rating = st.slider("Your Rating", 1, 100, 70)
             if st.button("✅ Save", type="primary"):
                 title = m.get('title', m.get('name'))
-                log_media(title, m['id'], m.get('genre_ids', []), {active_user: user_rating}, media_type, m['poster_path'])
+                log_media(title, m['id'], m.get('genre_ids', []), {active_user: user_rating}, m_type, m['poster_path'])
                 st.success("Logged!")
-                st.session_state.hidden_movies.add(str(m['id']))
-                hide_media_db(active_user, str(m['id']))
+                st.session_state.hidden_movies.add(m['id'])
+                hide_media_db(active_user, m['id'])
                 st.session_state.view_movie_detail = None
                 time.sleep(1)
                 st.rerun()
@@ -423,16 +746,12 @@ if nav_choice == "Home":
     elif search_query:
         st.subheader("Results")
         results = search_tmdb(search_query)
-        cols = st.columns(6)
-        for i, item in enumerate(results):
-            if not item.get('poster_path'): continue
-            with cols[i % 6]:
-                st.markdown(render_card(item['poster_path'], None), unsafe_allow_html=True)
-                if st.button("Log", key=f"s_{item['id']}"):
-                    item['title'] = item.get('title', item.get('name'))
-                    item['media_type'] = item.get('media_type', 'movie')
-                    st.session_state.view_movie_detail = item
-                    st.rerun()
+        results = [item for item in results if item.get('poster_path')]
+        for start in range(0, len(results), 6):
+            for col, item in zip(st.columns(6), results[start:start + 6]):
+                with col:
+                    st.markdown(render_card(item['poster_path'], None), unsafe_allow_html=True)
+                    st.button("Log", key=f"s_{item['id']}", on_click=open_detail, args=(item, item.get('media_type', 'movie')))
 
     # --- NETFLIX STYLE ROWS ---
     else:
@@ -446,41 +765,70 @@ if nav_choice == "Home":
         if sel_genres:
             genres_to_show = sel_genres
         else:
-            g_map_rev = get_genre_map_reversed(media_type)
-            genre_scores = {}
-            if not user_history.empty:
-                for _, row in user_history.iterrows():
-                    try:
-                        r = float(row['Rating'])
-                        parts = str(row['Genres']).replace("'", "").replace("[","").replace("]","").split(',')
-                        for p in parts:
-                            name = g_map_rev.get(p.strip(), p.strip())
-                            if name not in genre_scores: genre_scores[name] = []
-                            genre_scores[name].append(r)
-                    except: continue
+            # Ranking is kept per user/type/history version
+            rank_key = (active_user, media_type, st.session_state.history_version)
+            if st.session_state.get('rank_key') != rank_key:
+                g_map_rev = get_genre_map_reversed(media_type)
+                genre_scores = pd.Series(dtype=float)
+                if not user_history.empty:
+                    genre_names = split_genres(user_history['Genres'], g_map_rev)
+                    ratings = user_history['Rating'].loc[genre_names.index]
+                    genre_scores = ratings.groupby(genre_names.to_numpy()).mean().dropna().sort_values(ascending=False, kind='stable')
+                st.session_state.genre_scores, st.session_state.rank_key = genre_scores, rank_key
+            genre_scores = st.session_state.genre_scores
             
-            ranked = sorted([(k, sum(v)/len(v)) for k,v in genre_scores.items()], key=lambda x: x[1], reverse=True)
-            genre_scores_map = dict(ranked)
-            top_user_genres = [x[0] for x in ranked]
+            genre_scores_map = genre_scores.to_dict()
+            top_user_genres = [g for g in genre_scores.index if g in g_map]
             
             defaults = ["Action", "Comedy", "Sci-Fi", "Drama", "Thriller"] if media_type == "movie" else ["Drama", "Comedy", "Sci-Fi & Fantasy", "Animation", "Crime"]
-            genres_to_show = top_user_genres
-            for d in defaults:
-                if d not in genres_to_show: genres_to_show.append(d)
+            shown = set(top_user_genres)
+            genres_to_show = top_user_genres + [d for d in defaults if d not in shown]
             
             genres_to_show = genres_to_show[:5]
 
-        avoid_ids = set()
-        if not user_history.empty:
-            bad_movies = user_history[pd.to_numeric(user_history['Rating'], errors='coerce') <= 50]
-            avoid_ids = set(bad_movies['Movie_ID'].tolist())
-            avoid_ids.update(st.session_state.hidden_movies)
+        # Built once per user/type/history version; Hide adds to it in place
+        avoid_key = (active_user, media_type, st.session_state.history_version)
+        if st.session_state.get('avoid_key') != avoid_key:
+            avoid_ids = set(st.session_state.hidden_movies)
+            if not user_history.empty:
+                avoid_ids.update(user_history.loc[user_history['Rating'] <= 50, 'Movie_ID'].dropna().tolist())
+            st.session_state.avoid_ids, st.session_state.avoid_key = avoid_ids, avoid_key
+        avoid_ids = st.session_state.avoid_ids
 
-        # RENDER ROWS
+        # FETCH ROWS
+        row_specs = []
         for g_name in genres_to_show:
             g_id = g_map.get(g_name)
             if not g_id: continue
-            
+            page_key = f"{g_name}_{media_type}"
+            if page_key not in st.session_state.genre_pages: st.session_state.genre_pages[page_key] = 1
+            row_specs.append((g_name, g_id, page_key, st.session_state.genre_pages[page_key]))
+        
+        # Rows are refetched only when an input they depend on changes
+        rows_key = (active_user, media_type, tuple(prov_ids or ()), tuple(row_specs), frozenset(avoid_ids))
+        rows_cache = st.session_state.get('rows_cache')
+        if rows_cache and rows_cache[0] == rows_key and time.monotonic() - rows_cache[1] < ROWS_REFRESH:
+            row_results, pages_used = rows_cache[2], rows_cache[3]
+        else:
+            pages = parallel_map(lambda r: get_genre_rows_data(r[1], media_type, prov_ids, r[3], avoid_ids), row_specs)
+            # A title in several genres only shows in its first row
+            seen = set()
+            row_results = [take_unseen(movies, seen) for movies in pages]
+            # Short rows are topped up from their next page, which ➡️ then skips
+            short = [i for i, movies in enumerate(row_results) if len(movies) < 5]
+            extra = parallel_map(lambda i: get_genre_rows_data(row_specs[i][1], media_type, prov_ids, row_specs[i][3] + 1, avoid_ids), short)
+            pages_used = [1] * len(row_specs)
+            for i, movies in zip(short, extra):
+                row_results[i] += take_unseen(movies, seen, 5 - len(row_results[i]))
+                pages_used[i] = 2
+            st.session_state.rows_cache = (rows_key, time.monotonic(), row_results, pages_used)
+            # Warm each row's next unused page so ➡️ reads it straight from the cache
+            for r, used in zip(row_specs, pages_used): prefetch(get_genre_rows_data, r[1], media_type, prov_ids, r[3] + used)
+
+        flat_logos = iter(parallel_map(lambda x: get_watch_providers(x['id'], media_type), [m for movies in row_results for m in movies]))
+
+        # RENDER ROWS
+        for (g_name, g_id, page_key, _), movies, used in zip(row_specs, row_results, pages_used):
             # Dynamic Header Info
             header_suffix = ""
             if g_name in genre_scores_map:
@@ -489,50 +837,35 @@ if nav_choice == "Home":
             
             st.markdown(f"<div class='genre-header'>{g_name}</div>{header_suffix}", unsafe_allow_html=True)
             
-            page_key = f"{g_name}_{media_type}"
-            if page_key not in st.session_state.genre_pages: st.session_state.genre_pages[page_key] = 1
-            
-            movies = get_genre_rows_data(g_id, media_type, prov_ids, st.session_state.genre_pages[page_key], avoid_ids)
-            movies = movies[:5]
+            row_logos = [next(flat_logos) for _ in movies]
             
             cols = st.columns([1,1,1,1,1, 0.5])
             
-            for i, m in enumerate(movies):
-                with cols[i]:
-                    tmdb = int(m.get('vote_average', 0)*10)
-                    logos = get_watch_providers(m['id'], media_type)
-                    st.markdown(render_card(m['poster_path'], tmdb, None, logos), unsafe_allow_html=True)
+            for col, m, logos in zip(cols, movies, row_logos):
+                with col:
+                    st.markdown(render_card(m['poster_path'], int(m.get('vote_average', 0)*10), None, logos), unsafe_allow_html=True)
                     
-                    c1, c2, c3 = st.columns(3)
+                    c1, c2 = st.columns(2)
                     k = f"{g_name}_{m['id']}"
-                    with c1: 
-                        if st.button("Info", key=f"i_{k}"):
-                            m['title'] = m.get('title', m.get('name'))
-                            m['media_type'] = media_type
-                            st.session_state.view_movie_detail = m
-                            st.rerun()
+                    with c1:
+                        st.button("Log", key=f"l_{k}", on_click=open_detail, args=(m, media_type))
                     with c2:
-                        if st.button("Log", key=f"l_{k}"):
-                            m['title'] = m.get('title', m.get('name'))
-                            m['media_type'] = media_type
-                            st.session_state.view_movie_detail = m
-                            st.rerun()
-                    with c3:
-                        if st.button("Hide", key=f"h_{k}"):
-                            st.session_state.hidden_movies.add(str(m['id']))
-                            hide_media_db(active_user, str(m['id']))
-                            st.rerun()
+                        st.button("Hide", key=f"h_{k}", on_click=hide_card, args=(active_user, m['id']))
             
             with cols[5]:
                 st.write("")
                 st.write("")
-                if st.button("➡️", key=f"n_{page_key}"):
-                    st.session_state.genre_pages[page_key] += 1
-                    st.rerun()
+                st.button("➡️", key=f"n_{page_key}", on_click=next_page, args=(page_key, used))
 
 elif nav_choice == "Profile":
     st.header(f"Profile: {active_user}")
-    history = get_watched_history()
-    if not history.empty:
-        user_history = history[history['User'] == active_user]
-        st.dataframe(user_history)
+    if not st.session_state.history_df.empty:
+        st.dataframe(get_user_history(active_user))
+
+elif nav_choice == "Settings":
+    st.header("Settings")
+    if st.button("Refresh TMDB genres"):
+        drop_tmdb_cache("/genre/")
+        get_tmdb_genres.clear()
+        get_genre_map_reversed.clear()
+        st.toast("Genre lists will reload from TMDB.")